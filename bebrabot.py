@@ -12,6 +12,7 @@ from database_operations import (add_request_to_database,
                                  get_history_by_user_id, get_stats_by_user_id)
 from movie_operations import (get_movie_google_link_by_name,
                               get_movie_info_by_name)
+from resilience import get_upstreams_stats
 from utils import (get_functions_string, get_movie_string,
                    get_user_history_string, get_user_stats_string, say_hello,
                    search_failed)
@@ -20,6 +21,7 @@ connection = None
 cursor = None
 session = None
 dp = Dispatcher()
+UPSTREAMS_STATS_INTERVAL = 60
 
 
 @dp.message(Command("start"))
@@ -103,13 +105,26 @@ async def send_cinema(message: types.Message) -> None:
             await message.reply(search_failed())
 
 
+async def log_upstreams_stats() -> None:
+    """
+    Periodically log circuit breaker states and hedge rates
+    of the Kinopoisk and Google upstreams for monitoring
+    """
+
+    while True:
+        await asyncio.sleep(UPSTREAMS_STATS_INTERVAL)
+        for name, stats in get_upstreams_stats().items():
+            logging.info("Upstream %s: %s", name, stats)
+
+
 async def main() -> None:
     """
     The main entry point for the Bebrabot Telegram bot.
     This function initializes the SQLite database,
     creates the necessary table if it doesn't exist,
     sets up an aiohttp ClientSession for HTTP requests,
-    and starts the bot's polling loop
+    and starts the bot's polling loop along with
+    the periodic logging of upstreams stats
     """
     global session, connection, cursor
 
@@ -131,7 +146,11 @@ async def main() -> None:
     async with aiohttp.ClientSession() as http_session:
         session = http_session
         bot = Bot(os.environ["BOT_TOKEN"], parse_mode=ParseMode.MARKDOWN)
-        await dp.start_polling(bot)
+        stats_task = asyncio.create_task(log_upstreams_stats())
+        try:
+            await dp.start_polling(bot)
+        finally:
+            stats_task.cancel()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,16 @@
 """googlesearch is a Python library for searching Google, easily."""
+import asyncio
+import os
 import typing as tp
-from time import sleep
 
 import aiohttp
 from bs4 import BeautifulSoup
+from resilience import UpstreamError, google, is_unhealthy_status
 from user_agents import get_useragent
 
+SEARCH_URL = os.environ.get("GOOGLE_SEARCH_URL",
+                            "https://www.google.com/search")
+
 
 async def _req(
         session: aiohttp.ClientSession,
@@ -16,8 +21,21 @@ async def _req(
         proxies: tp.Optional[dict[str, str]],
         timeout: int) -> str:
 
+    return await google.call(lambda: _attempt(
+        session, term, results, lang, start, proxies, timeout))
+
+
+async def _attempt(
+        session: aiohttp.ClientSession,
+        term: str,
+        results: int,
+        lang: str,
+        start: int,
+        proxies: tp.Optional[dict[str, str]],
+        timeout: int) -> str:
+
     async with session.get(
-        url="https://www.google.com/search",
+        url=SEARCH_URL,
         headers={
             "User-Agent": get_useragent()
         },
@@ -30,6 +48,8 @@ async def _req(
         # proxies=proxies,
         timeout=timeout,
     ) as resp:
+        if is_unhealthy_status(resp.status):
+            raise UpstreamError(google.name, resp.status)
         resp.raise_for_status()
         return await resp.text()
 
@@ -79,9 +99,13 @@ async def search(
         # Parse
         soup = BeautifulSoup(resp, "html.parser")
         result_block = soup.find_all("div", attrs={"class": "g"})
+        found = 0
         for result in result_block:
             # Find link, title, description
-            link = result.find("a", href=True)
+            anchor = result.find("a", href=True)
+            if anchor is None:
+                continue
+            link = anchor["href"]
             try:
                 async with session.get(link) as responce:
                     if responce.status != 200:
@@ -95,5 +119,9 @@ async def search(
                 description = description_box.text
                 if link and title and description:
                     start += 1
+                    found += 1
                     yield link
-        sleep(sleep_interval)
+        # Stop if a whole page gave nothing, otherwise we would loop forever
+        if not found:
+            return
+        await asyncio.sleep(sleep_interval)
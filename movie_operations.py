@@ -1,13 +1,57 @@
+import asyncio
 import os
 import typing as tp
+from collections import OrderedDict
+from dataclasses import replace
 
 import aiohttp
 from data_classes import Movie
 from googlesearch import search
+from resilience import (UPSTREAM_FAILURES, CircuitOpenError, UpstreamError,
+                        is_unhealthy_status, kinopoisk)
 from utils import (choose_apropriate_description, choose_apropriate_picture,
                    normalize)
 
 headers = {"X-API-KEY": os.environ["KP_API_TOKEN"]}
+KINOPOISK_URL = os.environ.get("KP_API_URL", "https://api.kinopoisk.dev")
+GOOGLE_LINK_NOT_FOUND = "Ссылка пока не найдена"
+KINOPOISK_TIMEOUT = aiohttp.ClientTimeout(total=5)
+GOOGLE_LINK_TIMEOUT = 10
+MOVIES_CACHE_SIZE = 1024
+
+_movies_cache: OrderedDict[str, Movie] = OrderedDict()
+
+
+def _cache_movie(query: str, movie: Movie) -> None:
+    _movies_cache[query] = replace(movie)
+    _movies_cache.move_to_end(query)
+    if len(_movies_cache) > MOVIES_CACHE_SIZE:
+        _movies_cache.popitem(last=False)
+
+
+def _get_cached_movie(query: str) -> tp.Optional[Movie]:
+    movie = _movies_cache.get(query)
+    return replace(movie) if movie is not None else None
+
+
+async def _search_kinopoisk(
+    session: aiohttp.ClientSession, query: str
+) -> tp.Optional[dict[str, tp.Any]]:
+    async with session.get(
+        f"{KINOPOISK_URL}/v1.4/movie/search",
+        headers=headers,
+        params={"query": query},
+        timeout=KINOPOISK_TIMEOUT,
+    ) as response:
+        if is_unhealthy_status(response.status):
+            raise UpstreamError(kinopoisk.name, response.status)
+        if response.status != 200:
+            return None
+        data = await response.json()
+        try:
+            return data["docs"][0]
+        except IndexError:
+            return None
 
 
 async def get_movie_info_by_name(
@@ -16,55 +60,43 @@ async def get_movie_info_by_name(
     """
     Retrieve movie information by name
     using an asynchronous HTTP request to the Kinopoisk API
+
+    The request goes through the Kinopoisk circuit breaker and is hedged
+    when slow. If the API is unavailable, the last cached result
+    for the same query is returned instead
     :param name: The name of the movie to search for
     :return: A Movie object containing information
     about the movie if found, or None if not found
     """
 
     query = normalize(name)
-    params = {"query": query}
-    async with session.get(
-        "https://api.kinopoisk.dev/v1.4/movie/search",
-        headers=headers,
-        params=params,
-    ) as response:
-        if response.status == 200:
-            data = await response.json()
-            # if data['statusCode'] != 200:
-            #     return None
-            try:
-                required_info = data["docs"][0]
-                return (
-                    Movie(
-                        name=required_info["name"],
-                        eng_name=required_info["alternativeName"],
-                        genres=[genre["name"]
-                                for genre in required_info["genres"]],
-                        rating=required_info["rating"]["kp"],
-                        description=choose_apropriate_description(
-                            required_info["shortDescription"],
-                            required_info["description"],
-                        ),
-                        picture_url=await choose_apropriate_picture(
-                            session,
-                            required_info["poster"]["url"],
-                            required_info["backdrop"]["url"],
-                        ),
-                        crafted_link=f"https://vavada-qqq.com/#{required_info['id']}",
-                        google_link="Ссылка пока не найдена",
-                    )
-                    if required_info["name"]
-                    else None
-                )
-            except IndexError:
-                try:
-                    if data['statusCode'] == 403:
-                        pass
-                except Exception:
-                    pass
-                return None
-        else:
-            return None
+    try:
+        required_info = await kinopoisk.call(
+            lambda: _search_kinopoisk(session, query))
+    except (CircuitOpenError, *UPSTREAM_FAILURES):
+        return _get_cached_movie(query)
+    if required_info is None or not required_info["name"]:
+        return None
+    movie = Movie(
+        name=required_info["name"],
+        eng_name=required_info["alternativeName"],
+        genres=[genre["name"]
+                for genre in required_info["genres"]],
+        rating=required_info["rating"]["kp"],
+        description=choose_apropriate_description(
+            required_info["shortDescription"],
+            required_info["description"],
+        ),
+        picture_url=await choose_apropriate_picture(
+            session,
+            required_info["poster"]["url"],
+            required_info["backdrop"]["url"],
+        ),
+        crafted_link=f"https://vavada-qqq.com/#{required_info['id']}",
+        google_link=GOOGLE_LINK_NOT_FOUND,
+    )
+    _cache_movie(query, movie)
+    return movie
 
 
 async def get_movie_google_link_by_name(
@@ -80,8 +112,16 @@ async def get_movie_google_link_by_name(
 
     :param session: An aiohttp ClientSession for making HTTP requests.
     :param name: The name of the movie to search for.
-    :return: A first Google search result link for watching the movie online.
+    :return: A first Google search result link for watching the movie online,
+    or a placeholder if Google is unavailable, finds nothing or does not
+    manage to answer within GOOGLE_LINK_TIMEOUT seconds.
     """
 
-    return await search(session, f"{name} +смотреть"
-                        + "+онлайн", num_results=1).__anext__()
+    try:
+        return await asyncio.wait_for(
+            search(session, f"{name} +смотреть"
+                   + "+онлайн", num_results=1).__anext__(),
+            GOOGLE_LINK_TIMEOUT,
+        )
+    except (CircuitOpenError, StopAsyncIteration, *UPSTREAM_FAILURES):
+        return GOOGLE_LINK_NOT_FOUND
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import time
+import typing as tp
+from collections import deque
+
+import aiohttp
+
+T = tp.TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the upstream's breaker is open
+    """
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream answers with a status that signals
+    it is unhealthy or throttling us (403, 429, 5xx)
+    """
+
+    def __init__(self, upstream: str, status: int) -> None:
+        super().__init__(f"{upstream} responded with status {status}")
+        self.upstream = upstream
+        self.status = status
+
+
+UPSTREAM_FAILURES = (UpstreamError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def is_unhealthy_status(status: int) -> bool:
+    """
+    Check whether an HTTP status means the upstream is blocking or failing
+    :param status: The HTTP status code of the response
+    :return: True for 403, 429 and 5xx statuses
+    """
+
+    return status in (403, 429) or status >= 500
+
+
+class CircuitBreaker:
+    """
+    A consecutive-failure circuit breaker
+
+    After failure_threshold failures in a row the breaker opens and
+    rejects calls for reset_timeout seconds. Then a single probe call
+    is let through (half-open): its success closes the breaker,
+    its failure opens it again
+
+    Every state transition starts a new generation. A call is admitted
+    under the current generation, and its result is ignored if the
+    breaker has changed state since then
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.generation = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow_request(self) -> tp.Optional[int]:
+        """
+        Decide whether a call to the upstream may be made right now
+        :return: The generation the call is admitted under,
+        or None to fail fast
+        """
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return None
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return None
+            self._probe_in_flight = True
+        return self.generation
+
+    def record_success(self, generation: int) -> None:
+        """
+        Register a successful call and close the breaker
+        :param generation: The generation the call was admitted under
+        """
+
+        if generation != self.generation:
+            return
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        self._set_state(self.CLOSED)
+
+    def record_failure(self, generation: int) -> None:
+        """
+        Register a failed call and open the breaker if needed
+        :param generation: The generation the call was admitted under
+        """
+
+        if generation != self.generation:
+            return
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        if (self.state == self.HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def release(self, generation: int) -> None:
+        """
+        Forget a call that ended without a result (e.g. was cancelled),
+        so that a half-open breaker can admit a new probe
+        :param generation: The generation the call was admitted under
+        """
+
+        if generation == self.generation:
+            self._probe_in_flight = False
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning("Circuit breaker %s: %s -> %s",
+                       self.name, self.state, state)
+        self.state = state
+        self.generation += 1
+
+
+class LatencyTracker:
+    """
+    A sliding window of recent latencies used to compute an adaptive p95
+    """
+
+    def __init__(self, window: int = 100, min_samples: int = 20) -> None:
+        self.samples: deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def add(self, latency: float) -> None:
+        """
+        Add an observed latency to the window
+        :param latency: The latency of a successful call in seconds
+        """
+
+        self.samples.append(latency)
+
+    def p95(self) -> tp.Optional[float]:
+        """
+        Compute the 95th percentile of the latencies in the window
+        :return: The p95 in seconds, or None if there are too few samples
+        """
+
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class HedgeBudget:
+    """
+    A token bucket limiting hedged requests to a fraction of all requests
+
+    Every request adds ratio tokens (up to capacity),
+    and every hedge spends a whole token
+    """
+
+    def __init__(self, ratio: float = 0.1, capacity: float = 3.0) -> None:
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = 0.0
+
+    def deposit(self) -> None:
+        """
+        Add tokens for a new request
+        """
+
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Try to spend a token on a hedge
+        :return: True if the hedge may be sent
+        """
+
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class Upstream:
+    """
+    A resilient client wrapper for one upstream service
+
+    Calls go through a circuit breaker, and once the adaptive p95
+    latency is exceeded a second (hedged) attempt is started;
+    the first attempt to succeed wins and the other is cancelled.
+    Hedges are limited by a budget, are never sent for the half-open
+    probe, and are paused for reset_timeout seconds after the upstream
+    answers with 403 or 429. Only UPSTREAM_FAILURES count as breaker
+    failures, other exceptions are passed through untouched
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 min_hedge_delay: float = 0.05,
+                 hedge_ratio: float = 0.1) -> None:
+        self.name = name
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget(hedge_ratio)
+        self.min_hedge_delay = min_hedge_delay
+        self.throttled_until = 0.0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    async def call(self, attempt: tp.Callable[[], tp.Awaitable[T]]) -> T:
+        """
+        Run a request against the upstream with breaker and hedging
+        :param attempt: A factory producing a fresh request coroutine
+        :return: The result of the first successful attempt
+        :raises CircuitOpenError: If the breaker rejects the call
+        """
+
+        is_probe = self.breaker.state != CircuitBreaker.CLOSED
+        generation = self.breaker.allow_request()
+        if generation is None:
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        self.requests += 1
+        self.budget.deposit()
+        started = time.monotonic()
+        try:
+            result, hedge_won = await self._hedged(attempt, not is_probe)
+        except UPSTREAM_FAILURES:
+            self.failures += 1
+            self.breaker.record_failure(generation)
+            raise
+        except BaseException:
+            self.breaker.release(generation)
+            raise
+        self.latency.add(time.monotonic() - started)
+        if hedge_won:
+            self.hedge_wins += 1
+        self.breaker.record_success(generation)
+        return result
+
+    def _may_hedge(self) -> bool:
+        if time.monotonic() < self.throttled_until:
+            return False
+        return self.budget.withdraw()
+
+    def _check_throttling(self, error: BaseException) -> None:
+        if isinstance(error, UpstreamError) and error.status in (403, 429):
+            self.throttled_until = (time.monotonic()
+                                    + self.breaker.reset_timeout)
+
+    async def _hedged(
+        self, attempt: tp.Callable[[], tp.Awaitable[T]], hedge: bool
+    ) -> tuple[T, bool]:
+        primary = asyncio.ensure_future(attempt())
+        tasks = [primary]
+        p95 = self.latency.p95() if hedge else None
+        try:
+            if p95 is not None:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(p95, self.min_hedge_delay))
+                if not done and self._may_hedge():
+                    self.hedged += 1
+                    tasks.append(asyncio.ensure_future(attempt()))
+            pending = set(tasks)
+            errors: list[BaseException] = []
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        winner = task
+                    else:
+                        self._check_throttling(error)
+                        errors.append(error)
+                if winner is not None:
+                    return winner.result(), winner is not primary
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict[str, tp.Any]:
+        """
+        Collect the monitoring data of the upstream
+        :return: A dict with breaker state, latency and hedge counters
+        """
+
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "rejected": self.breaker.rejected,
+            "requests": self.requests,
+            "failures": self.failures,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "hedge_tokens": self.budget.tokens,
+            "p95": self.latency.p95(),
+        }
+
+
+kinopoisk = Upstream("kinopoisk")
+google = Upstream("google")
+
+
+def get_upstreams_stats() -> dict[str, dict[str, tp.Any]]:
+    """
+    Collect the monitoring data of all upstreams
+    :return: A dict mapping upstream names to their stats
+    """
+
+    return {upstream.name: upstream.stats()
+            for upstream in (kinopoisk, google)}
@@ -0,0 +1,331 @@
+import asyncio
+import time
+import typing as tp
+
+import aiohttp
+import googlesearch
+import movie_operations
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from resilience import (CircuitBreaker, CircuitOpenError, Upstream,
+                        UpstreamError)
+
+
+class StubServer:
+    """
+    A local stub of an upstream whose status and latency can be changed
+    """
+
+    def __init__(self) -> None:
+        self.status = 200
+        self.delays: list[float] = []
+        self.hits = 0
+        self.google_html = "<html></html>"
+        self.app = web.Application()
+        self.app.router.add_get("/v1.4/movie/search", self.kinopoisk)
+        self.app.router.add_get("/search", self.google)
+        self.app.router.add_get("/poster.jpg", self.poster)
+        self.server = TestServer(self.app)
+
+    async def _respond(self) -> tp.Optional[web.Response]:
+        self.hits += 1
+        if self.delays:
+            await asyncio.sleep(self.delays.pop(0))
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return None
+
+    async def kinopoisk(self, request: web.Request) -> web.Response:
+        error = await self._respond()
+        if error is not None:
+            return error
+        poster = str(self.server.make_url("/poster.jpg"))
+        return web.json_response({"docs": [{
+            "id": 409424,
+            "name": "Тёмный рыцарь",
+            "alternativeName": "The Dark Knight",
+            "genres": [{"name": "боевик"}],
+            "rating": {"kp": 8.5},
+            "shortDescription": "Бэтмен против Джокера",
+            "description": "",
+            "poster": {"url": poster},
+            "backdrop": {"url": poster},
+        }]})
+
+    async def google(self, request: web.Request) -> web.Response:
+        error = await self._respond()
+        if error is not None:
+            return error
+        return web.Response(text=self.google_html,
+                            content_type="text/html")
+
+    async def poster(self, request: web.Request) -> web.Response:
+        return web.Response(body=b"x" * 100)
+
+
+def run_with_stub(test: tp.Callable[..., tp.Awaitable[None]]) -> None:
+    async def runner() -> None:
+        stub = StubServer()
+        await stub.server.start_server()
+        try:
+            async with aiohttp.ClientSession() as session:
+                await test(stub, session)
+        finally:
+            await stub.server.close()
+
+    asyncio.run(runner())
+
+
+async def warm_up(upstream: Upstream, calls: int = 30) -> None:
+    async def fast() -> str:
+        await asyncio.sleep(0.001)
+        return "ok"
+
+    for _ in range(calls):
+        await upstream.call(fast)
+
+
+def test_breaker_opens_half_opens_and_closes(monkeypatch) -> None:
+    upstream = Upstream("google", failure_threshold=2, reset_timeout=0.1)
+    monkeypatch.setattr(googlesearch, "google", upstream)
+
+    async def test(stub: StubServer, session: aiohttp.ClientSession) -> None:
+        monkeypatch.setattr(googlesearch, "SEARCH_URL",
+                            str(stub.server.make_url("/search")))
+        stub.status = 503
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await googlesearch._req(session, "q", 1, "en", 0, None, 5)
+        assert upstream.breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            await googlesearch._req(session, "q", 1, "en", 0, None, 5)
+        assert stub.hits == 2
+
+        await asyncio.sleep(0.15)
+        stub.status = 200
+        await googlesearch._req(session, "q", 1, "en", 0, None, 5)
+        assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+    run_with_stub(test)
+
+
+def test_failed_probe_opens_breaker_again() -> None:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure(breaker.allow_request())
+    probe = breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request() is None
+    breaker.record_failure(probe)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_stale_results_do_not_change_state() -> None:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=100)
+    slow_success = breaker.allow_request()
+    slow_failure = breaker.allow_request()
+    breaker.record_failure(breaker.allow_request())
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.record_success(slow_success)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.reset_timeout = 0
+    probe = breaker.allow_request()
+    assert probe is not None
+    breaker.record_failure(slow_failure)
+    assert breaker.allow_request() is None
+    breaker.record_success(probe)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_probe_releases_breaker() -> None:
+    upstream = Upstream("test", failure_threshold=1, reset_timeout=0.05)
+
+    async def failing() -> None:
+        raise UpstreamError("test", 503)
+
+    async def hanging() -> None:
+        await asyncio.sleep(10)
+
+    async def ok() -> str:
+        return "ok"
+
+    async def scenario() -> None:
+        with pytest.raises(UpstreamError):
+            await upstream.call(failing)
+        await asyncio.sleep(0.06)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(upstream.call(hanging), 0.01)
+        assert upstream.breaker.state == CircuitBreaker.HALF_OPEN
+        assert await upstream.call(ok) == "ok"
+        assert upstream.breaker.state == CircuitBreaker.CLOSED
+        assert upstream.failures == 1
+
+    asyncio.run(scenario())
+
+
+def test_cached_card_served_while_kinopoisk_is_open(monkeypatch) -> None:
+    upstream = Upstream("kinopoisk", failure_threshold=1, reset_timeout=100)
+    monkeypatch.setattr(movie_operations, "kinopoisk", upstream)
+    monkeypatch.setattr(movie_operations, "_movies_cache", type(
+        movie_operations._movies_cache)())
+
+    async def test(stub: StubServer, session: aiohttp.ClientSession) -> None:
+        monkeypatch.setattr(movie_operations, "KINOPOISK_URL",
+                            str(stub.server.make_url("")).rstrip("/"))
+        movie = await movie_operations.get_movie_info_by_name(
+            session, "Тёмный рыцарь!")
+        assert movie is not None
+        movie.google_link = "https://example.com"
+
+        stub.status = 429
+        assert await movie_operations.get_movie_info_by_name(
+            session, "другой фильм") is None
+        assert upstream.breaker.state == CircuitBreaker.OPEN
+
+        cached = await movie_operations.get_movie_info_by_name(
+            session, "тёмный рыцарь")
+        assert cached is not None
+        assert cached.name == "Тёмный рыцарь"
+        assert cached.google_link == movie_operations.GOOGLE_LINK_NOT_FOUND
+        assert stub.hits == 2
+
+    run_with_stub(test)
+
+
+def test_placeholder_link_while_google_is_open(monkeypatch) -> None:
+    upstream = Upstream("google", failure_threshold=1, reset_timeout=100)
+    monkeypatch.setattr(googlesearch, "google", upstream)
+
+    async def test(stub: StubServer, session: aiohttp.ClientSession) -> None:
+        monkeypatch.setattr(googlesearch, "SEARCH_URL",
+                            str(stub.server.make_url("/search")))
+        stub.status = 429
+        for _ in range(2):
+            link = await movie_operations.get_movie_google_link_by_name(
+                session, "The Dark Knight")
+            assert link == movie_operations.GOOGLE_LINK_NOT_FOUND
+        assert upstream.breaker.state == CircuitBreaker.OPEN
+        assert stub.hits == 1
+
+    run_with_stub(test)
+
+
+def test_placeholder_link_when_google_finds_nothing(monkeypatch) -> None:
+    upstream = Upstream("google")
+    monkeypatch.setattr(googlesearch, "google", upstream)
+    monkeypatch.setattr(movie_operations, "GOOGLE_LINK_TIMEOUT", 1)
+
+    async def test(stub: StubServer, session: aiohttp.ClientSession) -> None:
+        monkeypatch.setattr(googlesearch, "SEARCH_URL",
+                            str(stub.server.make_url("/search")))
+        started = time.monotonic()
+        link = await movie_operations.get_movie_google_link_by_name(
+            session, "The Dark Knight")
+        assert link == movie_operations.GOOGLE_LINK_NOT_FOUND
+        assert time.monotonic() - started < 1
+        assert stub.hits == 1
+
+    run_with_stub(test)
+
+
+def test_google_link_is_found(monkeypatch) -> None:
+    monkeypatch.setattr(googlesearch, "google", Upstream("google"))
+
+    async def test(stub: StubServer, session: aiohttp.ClientSession) -> None:
+        monkeypatch.setattr(googlesearch, "SEARCH_URL",
+                            str(stub.server.make_url("/search")))
+        page = str(stub.server.make_url("/poster.jpg"))
+        stub.google_html = (
+            f'<div class="g"><a href="{page}"><h3>Тёмный рыцарь</h3></a>'
+            '<div style="-webkit-line-clamp:2">Смотреть онлайн</div></div>'
+        )
+        link = await movie_operations.get_movie_google_link_by_name(
+            session, "The Dark Knight")
+        assert link == page
+
+    run_with_stub(test)
+
+
+def test_own_errors_do_not_trip_breaker() -> None:
+    upstream = Upstream("test", failure_threshold=1, reset_timeout=0.05)
+
+    async def broken() -> None:
+        raise KeyError("docs")
+
+    async def failing() -> None:
+        raise UpstreamError("test", 503)
+
+    async def ok() -> str:
+        return "ok"
+
+    async def scenario() -> None:
+        with pytest.raises(KeyError):
+            await upstream.call(broken)
+        assert upstream.breaker.state == CircuitBreaker.CLOSED
+        assert upstream.failures == 0
+
+        with pytest.raises(UpstreamError):
+            await upstream.call(failing)
+        await asyncio.sleep(0.06)
+        with pytest.raises(KeyError):
+            await upstream.call(broken)
+        assert upstream.breaker.state == CircuitBreaker.HALF_OPEN
+        assert await upstream.call(ok) == "ok"
+        assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_hedge_fires_once_p95_is_exceeded(monkeypatch) -> None:
+    upstream = Upstream("google")
+    monkeypatch.setattr(googlesearch, "google", upstream)
+
+    async def test(stub: StubServer, session: aiohttp.ClientSession) -> None:
+        monkeypatch.setattr(googlesearch, "SEARCH_URL",
+                            str(stub.server.make_url("/search")))
+        await warm_up(upstream)
+        stub.delays = [2.0]
+        await googlesearch._req(session, "q", 1, "en", 0, None, 5)
+        assert upstream.hedged == 1
+        assert upstream.hedge_wins == 1
+        assert stub.hits == 2
+
+    run_with_stub(test)
+
+
+def test_hedges_are_limited_by_budget() -> None:
+    upstream = Upstream("test")
+
+    async def slow() -> str:
+        await asyncio.sleep(0.06)
+        return "ok"
+
+    async def scenario() -> None:
+        await warm_up(upstream)
+        await asyncio.gather(*(upstream.call(slow) for _ in range(50)))
+        assert upstream.hedged <= 3 + 0.1 * 50
+
+    asyncio.run(scenario())
+
+
+def test_no_hedges_after_throttling() -> None:
+    upstream = Upstream("test")
+
+    async def throttled() -> None:
+        raise UpstreamError("test", 429)
+
+    async def slow() -> str:
+        await asyncio.sleep(0.06)
+        return "ok"
+
+    async def scenario() -> None:
+        await warm_up(upstream)
+        with pytest.raises(UpstreamError):
+            await upstream.call(throttled)
+        await upstream.call(slow)
+        assert upstream.hedged == 0
+
+    asyncio.run(scenario())